@@ -1,8 +1,17 @@
 import streamlit as st
-import google.generativeai as genai
+from google import genai
+from google.genai import errors, types
 import streamlit.components.v1 as components
 import re
+import ast
+import json
+import numpy as np
 from abc import ABC, abstractmethod
+import asyncio
+import httpx
+import time
+import threading
+from hashlib import blake2b
 
 # ==========================================
 # CONFIGURATION & CONSTANTS
@@ -51,26 +60,55 @@ Footer (optional): links, credits, etc.
 - Keep lines under 80-100 characters when possible.
 """
 
+MERMAID_JS_URL = "https://cdn.jsdelivr.net/npm/mermaid@10.9.0/dist/mermaid.min.js"
+DOMPURIFY_JS_URL = "https://cdn.jsdelivr.net/npm/dompurify@3.1.6/dist/purify.min.js"
+# Published Subresource Integrity ("sha384-...") values for the pinned files above.
+# TODO: fill in from the release; the integrity attribute is omitted while empty.
+MERMAID_JS_SRI = ""
+DOMPURIFY_JS_SRI = ""
+
+# Explicit context caches need ~1k tokens of content; smaller files are sent inline
+CONTEXT_CACHE_MIN_CHARS = 4_096
+CONTEXT_CACHE_TTL = 60 * 60
+
+# Above this size (~4k tokens), strategies that only need structure get a skeleton
+SKELETON_THRESHOLD_CHARS = 16_000
+
+# Precompiled once at import instead of on every call / every line.
+# Type hints (": int", ": List<str>") or stray generic brackets; "\n" is excluded
+# so a match never spans lines, as when the sanitizer worked line by line.
+_SANITIZE_RE = re.compile(r':[^\S\n]*\w+(?:<[^>\n]*>)?|[<>]')
+# Lines containing square brackets (candidates for bracket stripping)
+_BRACKET_LINE_RE = re.compile(r'^[^\n\[\]]*[\[\]][^\n]*$', re.MULTILINE)
+_MERMAID_EXTRACT_RE = re.compile(r"```(?:mermaid|flowchart|classDiagram|erDiagram)(.*?)```", re.DOTALL)
+
 # ==========================================
 # DESIGN PATTERNS IMPLEMENTATION
 # ==========================================
 
 class DiagramStrategy(ABC):
     """Abstract Base Class defining the contract for diagram generators."""
-    @abstractmethod
-    def get_prompt(self, code_content: str) -> str:
-        pass
+    # True if a signatures-only skeleton of the code is enough for this diagram
+    accepts_skeleton = False
+
+    # Prompt boilerplate lives in class constants; get_prompt only concatenates
+    # it around the code, so no template text is rebuilt per call.
+    # Each subclass must define _PROMPT_PREFIX (no default, so a missing one fails loudly).
+    _PROMPT_SUFFIX = """
+        ```
+        """
 
     @abstractmethod
     def get_diagram_type_name(self) -> str:
         pass
 
+    def get_prompt(self, code_content: str) -> str:
+        return self._PROMPT_PREFIX + code_content + self._PROMPT_SUFFIX
+
 class ClassDiagramStrategy(DiagramStrategy):
-    def get_diagram_type_name(self):
-        return "Class Diagram"
+    accepts_skeleton = True
 
-    def get_prompt(self, code_content):
-        return f"""
+    _PROMPT_PREFIX = """
         Analyze the Python code and generate a Mermaid Class Diagram.
         
         CRITICAL SYNTAX RULES (Follow strictly or the diagram will crash):
@@ -83,80 +121,396 @@ class ClassDiagramStrategy(DiagramStrategy):
         
         PYTHON CODE:
         ```python
-        {code_content}
-        ```
         """
 
-class ERDDiagramStrategy(DiagramStrategy):
     def get_diagram_type_name(self):
-        return "ERD Diagram"
+        return "Class Diagram"
 
-    def get_prompt(self, code_content):
-        return f"""
+class ERDDiagramStrategy(DiagramStrategy):
+    _PROMPT_PREFIX = """
         Analyze the Python code (specifically looking for database models, SQL, or data structures) 
         and generate a Mermaid Entity Relationship Diagram (erDiagram).
         If no database logic exists, explain why.
 
         PYTHON CODE:
         ```python
-        {code_content}
-        ```
         """
 
-class UseCaseDiagramStrategy(DiagramStrategy):
     def get_diagram_type_name(self):
-        return "Use Case Diagram"
+        return "ERD Diagram"
 
-    def get_prompt(self, code_content):
-        return f"""
+class UseCaseDiagramStrategy(DiagramStrategy):
+    accepts_skeleton = True
+
+    _PROMPT_PREFIX = """
         Analyze the Python code to understand its functionality and actors.
         Generate a Mermaid Flowchart (TD) representing the Use Cases.
         Format: Actor -> [Action] -> System.
 
         PYTHON CODE:
         ```python
-        {code_content}
-        ```
         """
 
+    def get_diagram_type_name(self):
+        return "Use Case Diagram"
+
 class DiagramFactory:
     """Factory to select the correct diagram strategy based on user selection."""
+    # Strategies are stateless, so one shared instance per selectbox label
+    _STRATEGIES = {
+        "Class Diagram (Check for Patterns)": ClassDiagramStrategy(),
+        "ERD Diagram": ERDDiagramStrategy(),
+        "Use Case Diagram": UseCaseDiagramStrategy(),
+    }
+
+    @staticmethod
+    def options() -> tuple:
+        return tuple(DiagramFactory._STRATEGIES)
+
+    @staticmethod
+    def all_strategies() -> list:
+        return list(DiagramFactory._STRATEGIES.values())
+
     @staticmethod
     def create_generator(selection: str) -> DiagramStrategy:
-        if "Class" in selection:
-            return ClassDiagramStrategy()
-        elif "ERD" in selection:
-            return ERDDiagramStrategy()
-        elif "Use Case" in selection:
-            return UseCaseDiagramStrategy()
-        else:
-            return ClassDiagramStrategy() # Default
+        default = DiagramFactory._STRATEGIES["Class Diagram (Check for Patterns)"]
+        return DiagramFactory._STRATEGIES.get(selection, default)
 
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
 
+# Cached helpers: Streamlit skips hashing arguments whose name starts with "_".
+# Large or unhashable inputs (prompts, raw bytes, clients) are passed that way,
+# and the function is keyed on a small identifier (code hash, file_id) instead.
+
+@st.cache_resource
+def get_client(api_key: str):
+    """
+    Builds the Gemini client once per process and shares it across reruns.
+    Keyed on the API key so changing the key yields a fresh client.
+    """
+    return genai.Client(api_key=api_key)
+
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60)
+def cached_generate(model_name: str, code_hash: str, prompt_kind: str, _prompt: str, _client) -> str:
+    """
+    Memoizes Gemini responses for 24 hours, keyed on (model, code hash, prompt kind).
+    """
+    response = _client.models.generate_content(model=model_name, contents=_prompt)
+    return response.text
+
+@st.cache_data(show_spinner=False, ttl=60 * 60, max_entries=32)
+def read_uploaded(file_id: str, _data: bytes) -> str:
+    """
+    Decodes an upload once per file_id instead of on every rerun.
+    file_id is unique per upload, so entries are bounded by count and age.
+    """
+    return _data.decode("utf-8")
+
+STREAM_CACHE_TTL = 24 * 60 * 60
+STREAM_CACHE_MAX_ENTRIES = 100
+
+@st.cache_resource
+def get_stream_cache():
+    """
+    Process-wide store for streamed responses (st.cache_data can't memoize a stream),
+    with a lock since every session's script thread shares it.
+    """
+    return {}, threading.Lock()
+
+def _store_streamed(cache_key, text):
+    """Stores a finished response, dropping expired entries and the oldest beyond the cap."""
+    cache, lock = get_stream_cache()
+    now = time.time()
+    with lock:
+        for key in [k for k, (stored_at, _) in cache.items() if now - stored_at >= STREAM_CACHE_TTL]:
+            del cache[key]
+        cache.pop(cache_key, None)
+        cache[cache_key] = (now, text)
+        # Insertion order is storage order, so the first keys are the oldest
+        while len(cache) > STREAM_CACHE_MAX_ENTRIES:
+            del cache[next(iter(cache))]
+
+def stream_generate(client, model_name, cache_key, prompt):
+    """
+    Yields the response text as it streams in. Complete responses are stored
+    under cache_key, so repeats are served at once without an API call.
+    """
+    cache, _ = get_stream_cache()
+    cache_key = (model_name, cache_key)
+    hit = cache.get(cache_key)
+    if hit and time.time() - hit[0] < STREAM_CACHE_TTL:
+        yield hit[1]
+        return
+
+    chunks = []
+    for chunk in client.models.generate_content_stream(model=model_name, contents=prompt):
+        if chunk.text:
+            chunks.append(chunk.text)
+            yield chunk.text
+    _store_streamed(cache_key, "".join(chunks))
+
+@st.cache_resource
+def get_event_loop():
+    """
+    One long-lived event loop on a background thread. All async calls run on it,
+    so the shared client's async connection pool (bound to a single loop) is
+    reused across clicks instead of re-handshaking on every asyncio.run().
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def _generate_concurrently(client, model_name, prompts):
+    responses = await asyncio.gather(*[
+        client.aio.models.generate_content(model=model_name, contents=p) for p in prompts
+    ])
+    return [r.text for r in responses]
+
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60)
+def cached_generate_many(model_name: str, code_hash: str, prompt_kinds: tuple, _prompts: list, _client) -> list:
+    """
+    Runs several prompts concurrently via the async API and memoizes the results,
+    keyed like cached_generate.
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _generate_concurrently(_client, model_name, _prompts), get_event_loop()
+    )
+    return future.result()
+
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+def submit_batch_job(client, model_name, prompts):
+    """
+    Submits all prompts as one Gemini Batch Mode job (cheaper than unary calls).
+    Returns the job name, which is all that's needed to resume polling later.
+    """
+    job = client.batches.create(
+        model=model_name,
+        src=[{"contents": [{"role": "user", "parts": [{"text": p}]}]} for p in prompts],
+        config={"display_name": "code-analyzer-generate-all"},
+    )
+    return job.name
+
+class BatchJobFailed(Exception):
+    """The batch job reached a terminal state other than success."""
+
+def poll_batch_job(client, job_name, status, poll_seconds=10):
+    """
+    Polls a batch job until it finishes. Returns one text per prompt ("" on failure).
+    Raises BatchJobFailed only for a finished, unsuccessful job; any other error
+    (e.g. a network blip while polling) leaves the job running server-side.
+    """
+    job = client.batches.get(name=job_name)
+    while job.state.name not in BATCH_DONE_STATES:
+        status.update(label=f"Batch job running ({job.state.name})...")
+        time.sleep(poll_seconds)
+        job = client.batches.get(name=job_name)
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise BatchJobFailed(f"Batch job ended with state {job.state.name}")
+
+    return [r.response.text if r.response else "" for r in job.dest.inlined_responses]
+
+def create_code_cache(client, model_name, code_content):
+    """
+    Stores the code in an explicit Gemini context cache, so chat turns reference it
+    by name instead of resending it. Returns the cache name, or None if the code is
+    below the minimum cacheable size or the cache can't be created.
+    """
+    if len(code_content) < CONTEXT_CACHE_MIN_CHARS:
+        return None
+    try:
+        cache = client.caches.create(
+            model=model_name,
+            config=types.CreateCachedContentConfig(
+                contents=[{"role": "user", "parts": [{"text": f"Here is the code:\n{code_content}"}]}],
+                ttl=f"{CONTEXT_CACHE_TTL}s",
+            ),
+        )
+    except errors.APIError:
+        return None
+    return cache.name
+
+def start_code_chat(client, model_name, code_content, cache_name=None, messages=()):
+    """
+    Opens a chat session about the code. The session keeps its history client-side
+    and resends it every turn; with cache_name the code is referenced from the
+    context cache instead of being part of that history. Optional transcript
+    messages ({"role", "content"}) are replayed into the session history.
+    """
+    history = [] if cache_name else [
+        {"role": "user", "parts": [{"text": f"Here is the code:\n{code_content}"}]},
+        {"role": "model", "parts": [{"text": "Understood."}]},
+    ]
+    history += [
+        {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+        for m in messages
+    ]
+    config = types.GenerateContentConfig(cached_content=cache_name) if cache_name else None
+    return client.chats.create(model=model_name, config=config, history=history)
+
+def embed_text(client, text):
+    """Returns the unit-length embedding of a text, so a dot product is cosine similarity."""
+    result = client.models.embed_content(model="text-embedding-004", contents=text)
+    embedding = np.asarray(result.embeddings[0].values, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+def embed_question(client, prompt, previous_question=None):
+    """
+    Embeds a chat question together with the previous one, so follow-ups like
+    "show an example" only match within the same topic. Returns None if the
+    semantic cache is unavailable; after the first API failure it is switched off
+    for the session (with a one-time toast) so later turns don't retry it.
+    """
+    if st.session_state.get("semantic_cache_error"):
+        return None
+    text = f"{previous_question}\n{prompt}" if previous_question else prompt
+    try:
+        return embed_text(client, text)
+    except (errors.APIError, httpx.HTTPError) as e:
+        st.session_state.semantic_cache_error = str(e)
+        st.toast(f"Semantic answer cache disabled for this session: {e}", icon="⚠️")
+        return None
+
+def find_similar_answer(qa_cache, embedding, threshold=0.92):
+    """
+    Looks up the cached (embedding, question, answer) entry most similar to the
+    given embedding. Returns its answer if similarity exceeds the threshold.
+    """
+    if not qa_cache:
+        return None
+    similarities = np.stack([cached[0] for cached in qa_cache]) @ embedding
+    best = int(np.argmax(similarities))
+    return qa_cache[best][2] if similarities[best] > threshold else None
+
+_DOC_PROMPT_PREFIX = f"{DOC_STRUCTURE_RULES}\n\nPYTHON CODE TO DOCUMENT:\n```python\n"
+
+def get_doc_prompt(code_content):
+    """Combines the documentation rules with the code to document."""
+    return _DOC_PROMPT_PREFIX + code_content + "\n```"
+
+def _assigns_to_self(stmt):
+    targets = list(stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target])
+    while targets:
+        t = targets.pop()
+        # Unpacking targets, e.g. "self.a, self.b = a, b"
+        if isinstance(t, (ast.Tuple, ast.List)):
+            targets.extend(t.elts)
+        elif isinstance(t, ast.Attribute) and isinstance(t.value, ast.Name) and t.value.id == "self":
+            return True
+    return False
+
+class _SkeletonTransformer(ast.NodeTransformer):
+    """Replaces function bodies with '...', keeping docstrings and __init__ attributes."""
+    def _stub(self, node):
+        body = [node.body[0]] if ast.get_docstring(node) is not None else []
+        if node.name == "__init__":
+            body += [
+                stmt for stmt in node.body
+                if isinstance(stmt, (ast.Assign, ast.AnnAssign)) and _assigns_to_self(stmt)
+            ]
+        node.body = body + [ast.Expr(ast.Constant(...))]
+        return node
+
+    visit_FunctionDef = _stub
+    visit_AsyncFunctionDef = _stub
+
+def build_code_skeleton(code_content):
+    """
+    Reduces Python source to its structure (classes, signatures, attributes) by
+    stubbing function bodies, to cut prompt tokens. Top-level script code such as
+    "if __name__ == '__main__':" blocks is kept, since it shows actors and flows.
+    Falls back to the full source if it can't be parsed or unparsed.
+    """
+    # ValueError: null bytes in the source; RecursionError: very deeply nested code
+    try:
+        return ast.unparse(_SkeletonTransformer().visit(ast.parse(code_content)))
+    except (SyntaxError, ValueError, RecursionError):
+        return code_content
+
+def get_strategy_prompt(strategy, code_content, code_skeleton):
+    """Builds a diagram prompt, feeding the skeleton to strategies that accept it."""
+    return strategy.get_prompt(code_skeleton if strategy.accepts_skeleton else code_content)
+
+def _strip_list_brackets(match):
+    # Heuristic: Only remove [ if the line is NOT a relationship line (--|>, -->, etc)
+    line = match.group(0)
+    if '--' in line or '..' in line or '|' in line:
+        return line
+    return line.replace('[', '').replace(']', '')
+
 def sanitize_mermaid_code(code):
     """
     Removes Mermaid syntax-breaking characters from generated code.
     Focuses on removing Type Hints (e.g. : int, List<>).
     """
-    lines = code.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        # 1. Remove type hints after colons (e.g. ": int", ": List[str]")
-        line = re.sub(r':\s*\w+(?:<[^>]*>)?', '', line)
-        
-        # 2. Remove any remaining < > brackets used for generics (e.g. List<Item>)
-        line = line.replace('<', '').replace('>', '')
-        
-        # 3. Remove square brackets [] used for lists in text (not arrows)
-        # Heuristic: Only remove [ if the line is NOT a relationship line (--|>, -->, etc)
-        if '--' not in line and '..' not in line and '|' not in line:
-            line = line.replace('[', '').replace(']', '')
-            
-        cleaned_lines.append(line)
-    return '\n'.join(cleaned_lines)
+    # 1. Remove type hints after colons and any remaining < > generics, in one pass
+    code = _SANITIZE_RE.sub('', code)
+
+    # 2. Remove square brackets [] used for lists in text (not arrows),
+    # visiting only the lines that actually contain brackets
+    return _BRACKET_LINE_RE.sub(_strip_list_brackets, code)
+
+def get_script_tag(url, integrity):
+    """
+    Returns a <script src> tag for a JS library, so the browser loads it from its
+    HTTP cache across diagrams. With an SRI hash, the browser refuses altered files.
+    """
+    if not integrity:
+        return f'<script src="{url}"></script>'
+    return f'<script src="{url}" integrity="{integrity}" crossorigin="anonymous"></script>'
+
+def render_mermaid_diagram(output_text):
+    """
+    Extracts the Mermaid block from an AI response, sanitizes it and renders it.
+    """
+    # 1. Extract Mermaid Code
+    matches = _MERMAID_EXTRACT_RE.findall(output_text)
+    raw_mermaid = matches[0].strip() if matches else ""
+
+    if not raw_mermaid:
+        st.error("❌ Could not extract diagram code from AI response.")
+        return
+
+    # 2. Debug View (Hidden by default)
+    with st.expander("🐞 Debug View (Raw Code)", expanded=False):
+        st.code(raw_mermaid, language="markdown")
+
+    # 3. Sanitize Code (Fix Syntax Errors)
+    clean_mermaid = sanitize_mermaid_code(raw_mermaid)
+
+    # 4. Render HTML Injection: the SVG is passed through DOMPurify before
+    # it touches the DOM, since the diagram source comes from the LLM
+    mermaid_source = json.dumps(clean_mermaid).replace("</", "<\\/")
+    html_template = f"""
+    <div id="diagram" style="width: 100%; overflow: auto; display: flex; justify-content: center;"></div>
+    {get_script_tag(MERMAID_JS_URL, MERMAID_JS_SRI)}
+    {get_script_tag(DOMPURIFY_JS_URL, DOMPURIFY_JS_SRI)}
+    <script>
+        mermaid.initialize({{
+            startOnLoad: false,
+            theme: 'default',
+            securityLevel: 'strict'
+        }});
+        const diagram = document.getElementById('diagram');
+        mermaid.render('generated-diagram', {mermaid_source}).then(({{ svg }}) => {{
+            diagram.innerHTML = DOMPurify.sanitize(
+                svg,
+                // html + foreignObject keep Mermaid's HTML node labels intact
+                {{ USE_PROFILES: {{ svg: true, svgFilters: true, html: true }}, ADD_TAGS: ['foreignObject'] }}
+            );
+        }}).catch((err) => {{
+            // Show the parse error instead of leaving the frame blank
+            diagram.style.color = '#b00020';
+            diagram.textContent = 'Mermaid could not render this diagram: ' + (err && err.message ? err.message : err);
+        }});
+    </script>
+    """
+    
+    st.success("Rendering diagram...")
+    components.html(html_template, height=600, scrolling=False)
 
 # ==========================================
 # STREAMLIT APP UI
@@ -175,16 +529,32 @@ if not api_key:
     st.warning("Please enter your API Key in the sidebar.")
     st.stop()
 
-# Configure API
-genai.configure(api_key=api_key)
+# Keep the client in session_state so reruns don't rebuild it; refresh on key change
+if st.session_state.get("genai_api_key") != api_key:
+    st.session_state.genai_client = get_client(api_key)
+    st.session_state.genai_api_key = api_key
+client = st.session_state.genai_client
 
 # --- FILE UPLOAD ---
 st.header("📄 Upload Python Code")
 uploaded_file = st.file_uploader("Choose a .py file", type=['py'])
 
 code_content = ""
+code_hash = ""
+code_skeleton = ""
 if uploaded_file is not None:
-    code_content = uploaded_file.read().decode("utf-8")
+    code_content = read_uploaded(uploaded_file.file_id, uploaded_file.getvalue())
+    # Hash once per upload; all caches are keyed on the digest, not the full source
+    if st.session_state.get("code_file_id") != uploaded_file.file_id:
+        st.session_state.code_hash = blake2b(code_content.encode(), digest_size=16).hexdigest()
+        st.session_state.code_file_id = uploaded_file.file_id
+        # Large files: structural skeleton for diagrams that don't need bodies
+        st.session_state.code_skeleton = (
+            build_code_skeleton(code_content)
+            if len(code_content) > SKELETON_THRESHOLD_CHARS else code_content
+        )
+    code_hash = st.session_state.code_hash
+    code_skeleton = st.session_state.code_skeleton
     with st.expander("View Uploaded Code", expanded=False):
         st.code(code_content, language='python')
 
@@ -194,10 +564,38 @@ tab1, tab2, tab3 = st.tabs(["💬 Chat", "📝 Documentation", "📊 Diagrams"])
 # ==========================
 # TAB 1: CHAT
 # ==========================
-with tab1:
+# A fragment: sending a message reruns only the chat, not the whole page
+# (upload, documentation and rendered diagrams stay as they are)
+@st.fragment
+def render_chat(client, api_key, code_content, code_hash):
     st.header("Chat with Code")
     if "messages" not in st.session_state: 
         st.session_state.messages = []
+
+    # (Re)start the chat session when the code or API key changes; the old
+    # transcript belongs to the previous session, so it is cleared as well.
+    # The context cache is also renewed shortly before its TTL runs out.
+    source_changed = st.session_state.get("chat_source") != (api_key, code_hash)
+    cache_expiring = time.time() > st.session_state.get("chat_cache_expires", float("inf")) - 60
+    if code_content and (source_changed or cache_expiring):
+        if source_changed:
+            st.session_state.chat_source = (api_key, code_hash)
+            st.session_state.messages = []
+            st.session_state.qa_cache = []
+        # Free the previous cache rather than leaving it to bill until its TTL
+        if st.session_state.get("chat_cache"):
+            try:
+                client.caches.delete(name=st.session_state.chat_cache)
+            except errors.APIError:
+                pass
+        st.session_state.chat_cache = create_code_cache(client, "gemini-2.5-flash-lite", code_content)
+        st.session_state.chat_cache_expires = (
+            time.time() + CONTEXT_CACHE_TTL if st.session_state.chat_cache else float("inf")
+        )
+        st.session_state.chat = start_code_chat(
+            client, "gemini-2.5-flash-lite", code_content,
+            st.session_state.chat_cache, st.session_state.messages
+        )
     
     # Display History
     for message in st.session_state.messages:
@@ -210,13 +608,37 @@ with tab1:
             st.session_state.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"):
                 st.markdown(prompt)
-            
-            model = genai.GenerativeModel(model_name="gemini-2.5-flash-lite")
-            response = model.generate_content(f"Code: {code_content}\nQ: {prompt}")
-            
+
+            # Semantic cache: near-duplicate questions (in the same context) reuse an earlier answer
+            previous_questions = [m["content"] for m in st.session_state.messages[:-1] if m["role"] == "user"]
+            question_embedding = embed_question(client, prompt, previous_questions[-1] if previous_questions else None)
+            answer = None
+            if question_embedding is not None:
+                answer = find_similar_answer(st.session_state.qa_cache, question_embedding)
+            cache_hit = answer is not None
+
             with st.chat_message("assistant"):
-                st.markdown(response.text)
-            st.session_state.messages.append({"role": "assistant", "content": response.text})
+                if cache_hit:
+                    st.markdown(answer)
+                else:
+                    # Stream tokens to the UI as they arrive
+                    answer = st.write_stream(
+                        chunk.text or "" for chunk in st.session_state.chat.send_message_stream(prompt)
+                    )
+                    if question_embedding is not None:
+                        st.session_state.qa_cache.append((question_embedding, prompt, answer))
+            st.session_state.messages.append({"role": "assistant", "content": answer})
+
+            # A cached answer never went through the chat session; rebuild it from
+            # the transcript so the model's history matches what the user sees
+            if cache_hit:
+                st.session_state.chat = start_code_chat(
+                    client, "gemini-2.5-flash-lite", code_content,
+                    st.session_state.chat_cache, st.session_state.messages
+                )
+
+with tab1:
+    render_chat(client, api_key, code_content, code_hash)
 
 # ==========================
 # TAB 2: DOCUMENTATION (UPDATED AS REQUESTED)
@@ -230,28 +652,24 @@ with tab2:
         if not code_content:
             st.error("Please upload a Python file first!")
         else:
+            # Combine rules + code
+            doc_prompt = get_doc_prompt(code_content)
+            
+            # Display result, streamed as it is written (served from cache on repeats)
+            st.markdown("---")
+            st.markdown("### Generated Documentation Preview:")
             with st.spinner("Analyzing code and writing documentation..."):
-                # Initialize a fresh model for Doc generation (clean slate)
-                model_doc = genai.GenerativeModel(model_name="gemini-2.5-flash-lite")
-                
-                # Combine rules + code
-                doc_prompt = f"{DOC_STRUCTURE_RULES}\n\nPYTHON CODE TO DOCUMENT:\n```python\n{code_content}\n```"
-                
-                response = model_doc.generate_content(doc_prompt)
-                markdown_output = response.text
-                
-                # Display result
-                st.markdown("---")
-                st.markdown("### Generated Documentation Preview:")
-                st.markdown(markdown_output)
-                
-                # Provide a download button
-                st.download_button(
-                    label="📥 Download README.md",
-                    data=markdown_output,
-                    file_name="README.md",
-                    mime="text/markdown"
+                markdown_output = st.write_stream(
+                    stream_generate(client, "gemini-2.5-flash-lite", ("doc", code_hash), doc_prompt)
                 )
+            
+            # Provide a download button
+            st.download_button(
+                label="📥 Download README.md",
+                data=markdown_output,
+                file_name="README.md",
+                mime="text/markdown"
+            )
 
 # ==========================
 # TAB 3: DIAGRAMS
@@ -263,12 +681,12 @@ with tab3:
         st.info("👈 Please upload a Python file to generate diagrams.")
     else:
         # Controls
-        col_select, col_btn = st.columns([2, 1])
+        col_select, col_btn, col_all = st.columns([2, 1, 1])
         
         with col_select:
             diagram_selection = st.selectbox(
                 "Choose Diagram Type",
-                ("Class Diagram (Check for Patterns)", "ERD Diagram", "Use Case Diagram")
+                DiagramFactory.options()
             )
         
         with col_btn:
@@ -276,6 +694,15 @@ with tab3:
             st.write("") 
             generate_clicked = st.button("🎨 Generate", type="primary", use_container_width=True)
 
+        with col_all:
+            st.write("") 
+            st.write("") 
+            generate_all_clicked = st.button("🧩 Generate All", use_container_width=True)
+
+        use_batch = st.checkbox(
+            "💸 Batch Mode: also write the README and submit everything as one cheaper batch job (slower)"
+        )
+
         # Generator Logic
         if generate_clicked:
             col_code, col_diagram = st.columns(2)
@@ -292,44 +719,71 @@ with tab3:
                 with st.spinner("Analyzing code structure..."):
                     # 1. Use Factory to get strategy
                     generator_strategy = DiagramFactory.create_generator(diagram_selection)
-                    prompt = generator_strategy.get_prompt(code_content)
-                    
-                    # 2. Call AI
-                    model = genai.GenerativeModel(model_name="gemini-2.5-flash-lite")
-                    response = model.generate_content(prompt)
-                    output_text = response.text
-
-                # 3. Extract Mermaid Code
-                pattern = r"```(?:mermaid|flowchart|classDiagram|erDiagram)(.*?)```"
-                matches = re.findall(pattern, output_text, re.DOTALL)
-                raw_mermaid = matches[0].strip() if matches else ""
-
-                if raw_mermaid:
-                    # 4. Debug View (Hidden by default)
-                    with st.expander("🐞 Debug View (Raw Code)", expanded=False):
-                        st.code(raw_mermaid, language="markdown")
-
-                    # 5. Sanitize Code (Fix Syntax Errors)
-                    clean_mermaid = sanitize_mermaid_code(raw_mermaid)
-
-                    # 6. Render HTML Injection
-                    html_template = f"""
-                    <div style="width: 100%; overflow: auto; display: flex; justify-content: center;">
-                        <pre class="mermaid">
-                        {clean_mermaid}
-                        </pre>
-                    </div>
-                    <script src="https://cdn.jsdelivr.net/npm/mermaid@10.9.0/dist/mermaid.min.js"></script>
-                    <script>
-                        mermaid.initialize({{
-                            startOnLoad: true,
-                            theme: 'default',
-                            securityLevel: 'loose'
-                        }});
-                    </script>
-                    """
+                    prompt = get_strategy_prompt(generator_strategy, code_content, code_skeleton)
                     
-                    st.success("Rendering diagram...")
-                    components.html(html_template, height=600, scrolling=False)
-                else:
-                    st.error("❌ Could not extract diagram code from AI response.")
+                    # 2. Call AI (cached per code + diagram type)
+                    output_text = cached_generate(
+                        "gemini-2.5-flash-lite", code_hash, generator_strategy.get_diagram_type_name(), prompt, client
+                    )
+
+                # 3. Extract, sanitize and render
+                render_mermaid_diagram(output_text)
+
+        # Generate every diagram type concurrently (wall time ~ slowest call)
+        if generate_all_clicked and not use_batch:
+            strategies = DiagramFactory.all_strategies()
+
+            with st.spinner("Generating all diagrams..."):
+                prompt_kinds = tuple(s.get_diagram_type_name() for s in strategies)
+                prompts = [get_strategy_prompt(s, code_content, code_skeleton) for s in strategies]
+                results = cached_generate_many("gemini-2.5-flash-lite", code_hash, prompt_kinds, prompts, client)
+
+            diagram_tabs = st.tabs([s.get_diagram_type_name() for s in strategies])
+            for diagram_tab, output_text in zip(diagram_tabs, results):
+                with diagram_tab:
+                    render_mermaid_diagram(output_text)
+
+        # Batch Mode: README + all diagrams in a single batch job.
+        # Job names and finished results live in session_state (keyed on code_hash),
+        # so a rerun mid-poll resumes the same job instead of orphaning it.
+        batch_jobs = st.session_state.setdefault("batch_jobs", {})
+        batch_results = st.session_state.setdefault("batch_results", {})
+        strategies = DiagramFactory.all_strategies()
+
+        if generate_all_clicked and use_batch and code_hash not in batch_results and code_hash not in batch_jobs:
+            prompts = [get_doc_prompt(code_content)] + [get_strategy_prompt(s, code_content, code_skeleton) for s in strategies]
+            with st.spinner("Submitting batch job..."):
+                batch_jobs[code_hash] = submit_batch_job(client, "gemini-2.5-flash-lite", prompts)
+
+        if code_hash in batch_jobs:
+            with st.status("Waiting for batch job...", expanded=False) as status:
+                # Forget the job only once it reached a terminal state; a polling error
+                # or a rerun (Streamlit's stop exceptions aren't Exceptions) keeps it
+                # pending so the next run resumes the same job
+                try:
+                    batch_results[code_hash] = poll_batch_job(client, batch_jobs[code_hash], status)
+                    status.update(label="Batch job complete!", state="complete")
+                    del batch_jobs[code_hash]
+                except BatchJobFailed as e:
+                    status.update(label="Batch job failed", state="error")
+                    st.error(f"❌ {e}")
+                    del batch_jobs[code_hash]
+                except Exception as e:
+                    status.update(label="Lost contact with batch job", state="error")
+                    st.warning(f"⚠️ {e} (the job is still running; rerun the app to resume waiting)")
+
+        if use_batch and code_hash in batch_results:
+            markdown_output, *results = batch_results[code_hash]
+            result_tabs = st.tabs(["README.md"] + [s.get_diagram_type_name() for s in strategies])
+            with result_tabs[0]:
+                st.markdown(markdown_output)
+                st.download_button(
+                    label="📥 Download README.md",
+                    data=markdown_output,
+                    file_name="README.md",
+                    mime="text/markdown",
+                    key="batch_readme_download"
+                )
+            for diagram_tab, output_text in zip(result_tabs[1:], results):
+                with diagram_tab:
+                    render_mermaid_diagram(output_text)